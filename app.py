@@ -1,51 +1,295 @@
+import hashlib
+import hmac
+import importlib.util
+import io
 import os
+import shutil
 import streamlit as st
 import tempfile
-from typing import Optional
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, Optional, Tuple
 
-# Authentication configuration
-AUTH_USERNAME = os.getenv('AUTH_USERNAME', 'admin')
-AUTH_PASSWORD = os.getenv('AUTH_PASSWORD', 'changeme')
-ENABLE_AUTH = os.getenv('ENABLE_AUTH', 'true').lower() == 'true'
+from settings import API_KEYS, AUTH_PASS_HASH, AUTH_USER_HASH, ENABLE_AUTH, ENABLE_PROVIDER_FALLBACK
+
+# Models offered per provider; the first entry is the default selection
+PROVIDER_MODELS: Dict[str, Tuple[str, ...]] = {
+    "OpenAI": ("gpt-4o", "gpt-4o-mini", "gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"),
+    "Anthropic": ("claude-sonnet-4-20250514", "claude-3-5-haiku-latest"),
+    "Google": ("gemini-pro", "gemini-pro-vision"),
+    "Cohere": ("command", "command-light"),
+}
+DEFAULT_MODELS: Dict[str, str] = {provider: models[0] for provider, models in PROVIDER_MODELS.items()}
+
+def _show_login():
+    """Render the login form; returns False until the user has logged in."""
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.markdown("## Login")
+        
+        with st.form("login_form"):
+            username = st.text_input("Benutzername", key="username_form")
+            password = st.text_input("Passwort", type="password", key="password_form")
+            submitted = st.form_submit_button("Anmelden", use_container_width=True, type="primary")
+            
+            if submitted:
+                # Bitwise & so both digests are always compared
+                user_ok = hmac.compare_digest(hashlib.sha256(username.encode('utf-8')).digest(), AUTH_USER_HASH)
+                pass_ok = hmac.compare_digest(hashlib.sha256(password.encode('utf-8')).digest(), AUTH_PASS_HASH)
+                if user_ok & pass_ok:
+                    st.session_state["password_correct"] = True
+                    st.rerun()
+                else:
+                    st.error("❌ Ungültige Anmeldedaten")
+    return False
 
 def check_password():
     """Returns True if user entered correct password."""
+    return st.session_state.get("password_correct", False) or _show_login()
+
+def get_api_keys():
+    """Return the API keys configured in the environment."""
+    return API_KEYS
+
+@st.cache_resource
+def _get_promoai(provider: str, api_key: str, model: str, fallbacks: Tuple[Tuple[str, str, str], ...] = ()):
+    """Return a shared ProMoAI instance so its API client is reused across reruns."""
+    from promoai import ProMoAI
+    return ProMoAI(provider, api_key, model, fallbacks)
+
+def _promoai_for(available_keys: Dict[str, str], provider: str, model: str):
+    """Return the ProMoAI instance for the selected provider, with the other configured providers as fallbacks."""
+    fallbacks = tuple(
+        (name, key, DEFAULT_MODELS[name])
+        for name, key in available_keys.items()
+        if name != provider and name in DEFAULT_MODELS
+    ) if ENABLE_PROVIDER_FALLBACK else ()
+    return _get_promoai(provider, available_keys[provider], model, fallbacks)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _render_bpmn_png(bpmn_xml: str) -> Optional[bytes]:
+    """Render BPMN XML to PNG bytes, cached on the XML so reruns skip the Graphviz layout."""
+    from pm4py.visualization.bpmn import visualizer as bpmn_visualizer
+    from promoai import ProMoAI
     
-    if "password_correct" not in st.session_state:
-        # Show clean login form
-        col1, col2, col3 = st.columns([1, 2, 1])
-        with col2:
-            st.markdown("## Login")
-            
-            with st.form("login_form"):
-                username = st.text_input("Benutzername", key="username_form")
-                password = st.text_input("Passwort", type="password", key="password_form")
-                submitted = st.form_submit_button("Anmelden", use_container_width=True, type="primary")
-                
-                if submitted:
-                    if username == AUTH_USERNAME and password == AUTH_PASSWORD:
-                        st.session_state["password_correct"] = True
+    bpmn_graph = ProMoAI.visualize_bpmn(bpmn_xml)
+    if not bpmn_graph:
+        return None
+    
+    # Pipe Graphviz output straight into memory instead of a temp file
+    gviz = bpmn_visualizer.apply(bpmn_graph, parameters={"format": "png"})
+    return gviz.pipe(format="png")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _bpmn_stats(bpmn_xml: str) -> Tuple[Dict[str, int], int]:
+    """Return (element counts by local tag name, size in bytes) of the BPMN XML.
+    
+    Uses a streaming parse that clears each element, so memory stays flat
+    regardless of model size.
+    """
+    data = bpmn_xml.encode('utf-8')
+    counts = Counter()
+    for _, elem in ET.iterparse(io.BytesIO(data), events=('end',)):
+        counts[elem.tag.rsplit('}', 1)[-1]] += 1
+        elem.clear()
+    return dict(counts), len(data)
+
+# Minimum seconds between live preview updates; each update resends the whole text
+STREAM_REFRESH_INTERVAL = 0.1
+
+def _stream_xml(chunks) -> str:
+    """Show AI output live while it is generated; returns the full text."""
+    placeholder = st.empty()
+    text = ""
+    last_update = 0.0
+    try:
+        for chunk in chunks:
+            text += chunk
+            now = time.monotonic()
+            if now - last_update >= STREAM_REFRESH_INTERVAL:
+                placeholder.code(text, language="xml")
+                last_update = now
+    finally:
+        placeholder.empty()
+    return text
+
+def _notify(message: str):
+    """Queue a success message to show after the full-app rerun a fragment triggers."""
+    st.session_state["_notice"] = message
+
+@st.fragment
+def _handle_text(available_keys: Dict[str, str], selected_provider: str, selected_model: str):
+    """Input method: generate a model from a natural-language description."""
+    process_description = st.text_area(
+        "Prozessbeschreibung:",
+        placeholder="Beschreiben Sie Ihren Geschäftsprozess in natürlicher Sprache...",
+        height=150
+    )
+    
+    # Optional instructions field
+    with st.expander("⚙️ Erweiterte Optionen"):
+        custom_instructions = st.text_area(
+            "Zusätzliche Anweisungen (optional):",
+            placeholder="z.B.: Verwende deutsche Bezeichnungen, füge Swimlanes hinzu, nutze Message Events für Kommunikation, erstelle parallele Gateways wo möglich...",
+            height=80,
+            help="Diese Anweisungen werden dem AI-Prompt hinzugefügt um das Ergebnis zu beeinflussen"
+        )
+    
+    if st.button("🚀 Modell generieren", type="primary", use_container_width=True):
+        if process_description:
+            with st.spinner("Generiere Prozessmodell..."):
+                try:
+                    promoai = _promoai_for(available_keys, selected_provider, selected_model)
+                    result = promoai.generate_bpmn_from_text(process_description, custom_instructions, stream_to=_stream_xml)
+                    
+                    if result["status"] == "success":
+                        st.session_state["current_bpmn"] = result["bpmn_xml"]
+                        st.session_state["custom_instructions"] = custom_instructions
+                        _notify("✅ Modell erfolgreich generiert!")
+                        st.rerun()
+                except Exception as e:
+                    st.error(f"Fehler: {str(e)}")
+        else:
+            st.warning("Bitte geben Sie eine Beschreibung ein.")
+
+@st.fragment
+def _handle_event_log(available_keys: Dict[str, str], selected_provider: str, selected_model: str):
+    """Input method: discover a model from an uploaded event log."""
+    uploaded_file = st.file_uploader(
+        "Event Log auswählen:",
+        type=['xes', 'csv', 'gz'],
+        help="Unterstützte Formate: XES, CSV, GZ-komprimiert"
+    )
+    
+    if uploaded_file:
+        st.info(f"📄 {uploaded_file.name} geladen")
+        
+        if st.button("🔍 Prozess entdecken", type="primary", use_container_width=True):
+            with st.spinner("Analysiere Event Log..."):
+                try:
+                    # pm4py is heavy, so it is only imported once a log is analyzed
+                    from promoai import analyze_event_log, is_event_log_cached
+                    
+                    # Logs parsed before are served from the cache without touching the upload
+                    cache_key = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+                    result = analyze_event_log(None, cache_key=cache_key) if is_event_log_cached(cache_key) else None
+                    
+                    if result is None or result["status"] != "success":
+                        # Save uploaded file temporarily, streaming it in 1 MiB chunks
+                        name = uploaded_file.name.lower()
+                        suffix = ".xes.gz" if name.endswith(".xes.gz") else os.path.splitext(name)[1]
+                        uploaded_file.seek(0)
+                        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                            shutil.copyfileobj(uploaded_file, tmp, length=1024 * 1024)
+                            temp_path = tmp.name
+                        try:
+                            result = analyze_event_log(temp_path, cache_key=cache_key)
+                        finally:
+                            os.unlink(temp_path)
+                    
+                    if result["status"] == "success":
+                        st.session_state["current_bpmn"] = result["bpmn_xml"]
+                        _notify(f"✅ Prozess entdeckt! ({result['num_traces']} Traces, {result['num_events']} Events)")
                         st.rerun()
                     else:
-                        st.error("❌ Ungültige Anmeldedaten")
-        return False
-    else:
-        return True
+                        st.error(result["message"])
+                except Exception as e:
+                    st.error(f"Fehler: {str(e)}")
 
-def get_api_keys():
-    """Load API keys from environment variables."""
-    api_keys = {}
+@st.fragment
+def _handle_model_upload(available_keys: Dict[str, str], selected_provider: str, selected_model: str):
+    """Input method: improve an uploaded BPMN/Petri net model."""
+    uploaded_model = st.file_uploader(
+        "Modell hochladen:",
+        type=['bpmn', 'pnml', 'xml'],
+        help="Laden Sie ein bestehendes BPMN oder Petri Net Modell hoch"
+    )
     
-    if os.getenv('OPENAI_API_KEY'):
-        api_keys['OpenAI'] = os.getenv('OPENAI_API_KEY')
-    if os.getenv('ANTHROPIC_API_KEY'):
-        api_keys['Anthropic'] = os.getenv('ANTHROPIC_API_KEY')
-    if os.getenv('GOOGLE_API_KEY'):
-        api_keys['Google'] = os.getenv('GOOGLE_API_KEY')
-    if os.getenv('COHERE_API_KEY'):
-        api_keys['Cohere'] = os.getenv('COHERE_API_KEY')
+    if uploaded_model:
+        st.info(f"📊 {uploaded_model.name} geladen")
+        
+        improvement_request = st.text_area(
+            "Verbesserungsvorschläge:",
+            placeholder="Beschreiben Sie, wie das Modell verbessert werden soll...",
+            height=100
+        )
+        
+        if st.button("🔧 Modell verbessern", type="primary", use_container_width=True):
+            if improvement_request:
+                with st.spinner("Verbessere Modell..."):
+                    try:
+                        # Decode the uploaded buffer once; getvalue() does not consume
+                        # the stream, so repeated clicks still see the whole file
+                        model_content = uploaded_model.getvalue().decode('utf-8')
+                        st.session_state["current_bpmn"] = model_content
+                        
+                        # Initialize ProMoAI for improvement
+                        promoai = _promoai_for(available_keys, selected_provider, selected_model)
+                        
+                        # Improve model based on feedback; the model goes first so retries with
+                        # different feedback share a prompt prefix, which providers can cache
+                        # once it exceeds their minimum length (1024+ tokens, i.e. larger models)
+                        prompt = f"Original model:\n{model_content}\n\nImprove this BPMN model based on the following feedback: {improvement_request}"
+                        result = promoai.generate_bpmn_from_text(prompt, stream_to=_stream_xml)
+                        
+                        if result["status"] == "success":
+                            st.session_state["current_bpmn"] = result["bpmn_xml"]
+                            st.session_state["feedback_history"].append(improvement_request)
+                            _notify("✅ Modell verbessert!")
+                            st.rerun()
+                    except Exception as e:
+                        st.error(f"Fehler: {str(e)}")
+            else:
+                st.warning("Bitte beschreiben Sie die gewünschten Verbesserungen.")
+
+@st.fragment
+def _feedback_section(available_keys: Dict[str, str], selected_provider: str, selected_model: str):
+    """Iterative refinement form and feedback history."""
+    current_model = st.session_state["current_bpmn"]
+    st.markdown("---")
+    st.markdown("### 🔄 Modell verfeinern")
     
-    return api_keys
+    with st.form("feedback_form"):
+        feedback = st.text_area(
+            "Feedback für Verbesserung:",
+            placeholder="Was soll am Modell geändert werden?",
+            height=100
+        )
+        
+        if st.form_submit_button("Modell aktualisieren", use_container_width=True, type="primary"):
+            if feedback:
+                with st.spinner("Aktualisiere Modell..."):
+                    try:
+                        # Update model with feedback (model first, see above)
+                        prompt = f"Current model:\n{current_model}\n\nUpdate this BPMN model based on feedback: {feedback}"
+                        
+                        # Keep custom instructions if they exist
+                        custom_inst = st.session_state.get("custom_instructions", "")
+                        promoai = _promoai_for(available_keys, selected_provider, selected_model)
+                        result = promoai.generate_bpmn_from_text(prompt, custom_inst, stream_to=_stream_xml)
+                        
+                        if result["status"] == "success":
+                            st.session_state["current_bpmn"] = result["bpmn_xml"]
+                            st.session_state["feedback_history"].append(feedback)
+                            _notify("✅ Modell aktualisiert!")
+                            st.rerun()
+                    except Exception as e:
+                        st.error(f"Fehler: {str(e)}")
+    
+    # Show feedback history
+    feedback_history = st.session_state["feedback_history"]
+    if feedback_history:
+        with st.expander("📜 Feedback-Historie"):
+            for i, fb in enumerate(feedback_history, 1):
+                st.markdown(f"**Iteration {i}:** {fb}")
+
+# Input method label -> handler rendering that method's widgets
+INPUT_HANDLERS = {
+    "Text-Beschreibung": _handle_text,
+    "Event Log hochladen": _handle_event_log,
+    "BPMN/Petri Net hochladen": _handle_model_upload,
+}
 
 def main():
     """Main application logic."""
@@ -81,18 +325,7 @@ def main():
         st.error("⚠️ Keine API Keys konfiguriert! Bitte Administrator kontaktieren.")
         return
     
-    # Import ProMoAI components
-    try:
-        from promoai import ProMoAI, analyze_event_log
-        import pm4py
-        from pm4py.visualization.bpmn import visualizer as bpmn_visualizer
-    except ImportError as e:
-        st.error(f"Fehler beim Import: {str(e)}")
-        return
-    
     # Initialize session state
-    if "model_gen" not in st.session_state:
-        st.session_state["model_gen"] = None
     if "feedback_history" not in st.session_state:
         st.session_state["feedback_history"] = []
     if "current_bpmn" not in st.session_state:
@@ -113,21 +346,7 @@ def main():
         )
         
         # Model selection based on provider
-        if selected_provider == "OpenAI":
-            model_options = ["gpt-4o", "gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"]
-            default_model = "gpt-4o"
-        elif selected_provider == "Anthropic":
-            model_options = ["claude-sonnet-4-20250514"]
-            default_model = "claude-sonnet-4-20250514"
-        elif selected_provider == "Google":
-            model_options = ["gemini-pro", "gemini-pro-vision"]
-            default_model = "gemini-pro"
-        elif selected_provider == "Cohere":
-            model_options = ["command", "command-light"]
-            default_model = "command"
-        else:
-            model_options = ["gpt-4"]
-            default_model = "gpt-4"
+        model_options = PROVIDER_MODELS.get(selected_provider, ("gpt-4",))
         
         selected_model = st.selectbox("Model:", model_options)
         
@@ -146,7 +365,6 @@ def main():
         
         # Reset button
         if st.button("🔄 Zurücksetzen", use_container_width=True, type="secondary"):
-            st.session_state["model_gen"] = None
             st.session_state["feedback_history"] = []
             st.session_state["current_bpmn"] = None
             st.rerun()
@@ -157,185 +375,53 @@ def main():
     with col1:
         st.markdown("### 📝 Eingabe")
         
+        notice = st.session_state.pop("_notice", None)
+        if notice:
+            st.success(notice)
+        
         # Input method selection
         input_method = st.radio(
             "Wählen Sie eine Eingabemethode:",
-            ["Text-Beschreibung", "Event Log hochladen", "BPMN/Petri Net hochladen"],
+            list(INPUT_HANDLERS),
             horizontal=True
         )
         
-        if input_method == "Text-Beschreibung":
-            process_description = st.text_area(
-                "Prozessbeschreibung:",
-                placeholder="Beschreiben Sie Ihren Geschäftsprozess in natürlicher Sprache...",
-                height=150
-            )
-            
-            # Optional instructions field
-            with st.expander("⚙️ Erweiterte Optionen"):
-                custom_instructions = st.text_area(
-                    "Zusätzliche Anweisungen (optional):",
-                    placeholder="z.B.: Verwende deutsche Bezeichnungen, füge Swimlanes hinzu, nutze Message Events für Kommunikation, erstelle parallele Gateways wo möglich...",
-                    height=80,
-                    help="Diese Anweisungen werden dem AI-Prompt hinzugefügt um das Ergebnis zu beeinflussen"
-                )
-            
-            if st.button("🚀 Modell generieren", type="primary", use_container_width=True):
-                if process_description:
-                    with st.spinner("Generiere Prozessmodell..."):
-                        try:
-                            api_key = available_keys[selected_provider]
-                            promoai = ProMoAI(selected_provider, api_key, selected_model)
-                            result = promoai.generate_bpmn_from_text(process_description, custom_instructions)
-                            
-                            if result["status"] == "success":
-                                st.session_state["current_bpmn"] = result["bpmn_xml"]
-                                st.session_state["model_gen"] = promoai
-                                st.session_state["custom_instructions"] = custom_instructions
-                                st.success("✅ Modell erfolgreich generiert!")
-                        except Exception as e:
-                            st.error(f"Fehler: {str(e)}")
-                else:
-                    st.warning("Bitte geben Sie eine Beschreibung ein.")
-        
-        elif input_method == "Event Log hochladen":
-            uploaded_file = st.file_uploader(
-                "Event Log auswählen:",
-                type=['xes', 'csv', 'gz'],
-                help="Unterstützte Formate: XES, CSV, GZ-komprimiert"
-            )
-            
-            if uploaded_file:
-                st.info(f"📄 {uploaded_file.name} geladen")
-                
-                if st.button("🔍 Prozess entdecken", type="primary", use_container_width=True):
-                    with st.spinner("Analysiere Event Log..."):
-                        try:
-                            # Save uploaded file temporarily
-                            with tempfile.NamedTemporaryFile(delete=False, suffix=uploaded_file.name) as tmp:
-                                tmp.write(uploaded_file.getbuffer())
-                                temp_path = tmp.name
-                            
-                            result = analyze_event_log(temp_path)
-                            
-                            if result["status"] == "success":
-                                st.success(f"✅ Prozess entdeckt! ({result['num_traces']} Traces, {result['num_events']} Events)")
-                                # Convert to BPMN XML
-                                bpmn_xml = pm4py.write_bpmn(result["bpmn_model"])
-                                st.session_state["current_bpmn"] = bpmn_xml
-                            else:
-                                st.error(result["message"])
-                            
-                            os.unlink(temp_path)
-                        except Exception as e:
-                            st.error(f"Fehler: {str(e)}")
-        
-        else:  # BPMN/Petri Net upload
-            uploaded_model = st.file_uploader(
-                "Modell hochladen:",
-                type=['bpmn', 'pnml', 'xml'],
-                help="Laden Sie ein bestehendes BPMN oder Petri Net Modell hoch"
-            )
-            
-            if uploaded_model:
-                st.info(f"📊 {uploaded_model.name} geladen")
-                
-                improvement_request = st.text_area(
-                    "Verbesserungsvorschläge:",
-                    placeholder="Beschreiben Sie, wie das Modell verbessert werden soll...",
-                    height=100
-                )
-                
-                if st.button("🔧 Modell verbessern", type="primary", use_container_width=True):
-                    if improvement_request:
-                        with st.spinner("Verbessere Modell..."):
-                            try:
-                                # Read uploaded model
-                                model_content = uploaded_model.read().decode('utf-8')
-                                st.session_state["current_bpmn"] = model_content
-                                
-                                # Initialize ProMoAI for improvement
-                                api_key = available_keys[selected_provider]
-                                promoai = ProMoAI(selected_provider, api_key, selected_model)
-                                
-                                # Improve model based on feedback
-                                prompt = f"Improve this BPMN model based on the following feedback: {improvement_request}\n\nOriginal model:\n{model_content}"
-                                result = promoai.generate_bpmn_from_text(prompt)
-                                
-                                if result["status"] == "success":
-                                    st.session_state["current_bpmn"] = result["bpmn_xml"]
-                                    st.session_state["model_gen"] = promoai
-                                    st.session_state["feedback_history"].append(improvement_request)
-                                    st.success("✅ Modell verbessert!")
-                            except Exception as e:
-                                st.error(f"Fehler: {str(e)}")
-                    else:
-                        st.warning("Bitte beschreiben Sie die gewünschten Verbesserungen.")
+        INPUT_HANDLERS[input_method](available_keys, selected_provider, selected_model)
         
         # Feedback section for iterative refinement
         if st.session_state["current_bpmn"]:
-            st.markdown("---")
-            st.markdown("### 🔄 Modell verfeinern")
-            
-            with st.form("feedback_form"):
-                feedback = st.text_area(
-                    "Feedback für Verbesserung:",
-                    placeholder="Was soll am Modell geändert werden?",
-                    height=100
-                )
-                
-                if st.form_submit_button("Modell aktualisieren", use_container_width=True, type="primary"):
-                    if feedback and st.session_state["model_gen"]:
-                        with st.spinner("Aktualisiere Modell..."):
-                            try:
-                                # Update model with feedback
-                                current_model = st.session_state["current_bpmn"]
-                                prompt = f"Update this BPMN model based on feedback: {feedback}\n\nCurrent model:\n{current_model}"
-                                
-                                # Keep custom instructions if they exist
-                                custom_inst = st.session_state.get("custom_instructions", "")
-                                result = st.session_state["model_gen"].generate_bpmn_from_text(prompt, custom_inst)
-                                
-                                if result["status"] == "success":
-                                    st.session_state["current_bpmn"] = result["bpmn_xml"]
-                                    st.session_state["feedback_history"].append(feedback)
-                                    st.success("✅ Modell aktualisiert!")
-                                    st.rerun()
-                            except Exception as e:
-                                st.error(f"Fehler: {str(e)}")
-            
-            # Show feedback history
-            if st.session_state["feedback_history"]:
-                with st.expander("📜 Feedback-Historie"):
-                    for i, fb in enumerate(st.session_state["feedback_history"], 1):
-                        st.markdown(f"**Iteration {i}:** {fb}")
+            _feedback_section(available_keys, selected_provider, selected_model)
     
     with col2:
         st.markdown("### 📊 Visualisierung")
         
-        if st.session_state["current_bpmn"]:
+        # Read session state once for the whole column
+        current_bpmn = st.session_state["current_bpmn"]
+        feedback_history = st.session_state["feedback_history"]
+        
+        if current_bpmn:
             # Visualization tabs
             viz_tab1, viz_tab2, viz_tab3 = st.tabs(["Diagramm", "XML", "Export"])
             
             with viz_tab1:
                 try:
-                    # Try to visualize the BPMN
-                    if st.session_state["model_gen"]:
-                        bpmn_graph = st.session_state["model_gen"].visualize_bpmn(st.session_state["current_bpmn"])
-                        if bpmn_graph:
-                            # Save visualization
-                            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                                pm4py.save_vis_bpmn(bpmn_graph, tmp.name)
-                                st.image(tmp.name, use_container_width=True)
-                                os.unlink(tmp.name)
-                        else:
-                            st.info("Diagramm-Visualisierung wird vorbereitet...")
+                    # Reuse the last PNG while the XML is unchanged, skipping even the
+                    # cache-key hashing st.cache_data does on every call
+                    viz_hash = hashlib.blake2b(current_bpmn.encode('utf-8'), digest_size=8).digest()
+                    if st.session_state.get("_last_viz_hash") != viz_hash:
+                        st.session_state["_last_viz_png"] = _render_bpmn_png(current_bpmn)
+                        st.session_state["_last_viz_hash"] = viz_hash
+                    png = st.session_state["_last_viz_png"]
+                    if png:
+                        st.image(png, use_container_width=True)
+                    else:
+                        st.info("Diagramm-Visualisierung wird vorbereitet...")
                 except Exception as e:
                     st.warning(f"Visualisierung nicht verfügbar: {str(e)}")
                     st.info("Sie können das Modell trotzdem als XML anzeigen und exportieren.")
             
             with viz_tab2:
-                st.code(st.session_state["current_bpmn"], language="xml")
+                st.code(current_bpmn, language="xml")
             
             with viz_tab3:
                 col_exp1, col_exp2 = st.columns(2)
@@ -343,7 +429,7 @@ def main():
                 with col_exp1:
                     st.download_button(
                         label="📥 BPMN herunterladen",
-                        data=st.session_state["current_bpmn"],
+                        data=current_bpmn,
                         file_name="process_model.bpmn",
                         mime="application/xml",
                         use_container_width=True
@@ -352,11 +438,11 @@ def main():
                 with col_exp2:
                     # Convert to Petri Net if possible
                     try:
-                        if pm4py:
+                        if importlib.util.find_spec("pm4py"):
                             # This would need proper conversion logic
                             st.download_button(
                                 label="📥 Als PNML exportieren",
-                                data=st.session_state["current_bpmn"],  # This should be converted
+                                data=current_bpmn,  # This should be converted
                                 file_name="process_model.pnml",
                                 mime="application/xml",
                                 use_container_width=True
@@ -368,11 +454,13 @@ def main():
                 st.markdown("---")
                 st.markdown("**Modell-Statistiken:**")
                 try:
-                    lines = st.session_state["current_bpmn"].count('\n')
-                    size = len(st.session_state["current_bpmn"])
-                    st.metric("Zeilen", lines)
-                    st.metric("Größe", f"{size:,} Zeichen")
-                    st.metric("Iterationen", len(st.session_state["feedback_history"]))
+                    counts, size = _bpmn_stats(current_bpmn)
+                    col_tasks, col_gateways, col_flows = st.columns(3)
+                    col_tasks.metric("Tasks", sum(n for tag, n in counts.items() if tag == "task" or tag.endswith("Task")))
+                    col_gateways.metric("Gateways", sum(n for tag, n in counts.items() if tag.endswith("Gateway")))
+                    col_flows.metric("Sequenzflüsse", counts.get("sequenceFlow", 0))
+                    st.metric("Größe", f"{size:,} Bytes")
+                    st.metric("Iterationen", len(feedback_history))
                 except:
                     pass
         else:
@@ -4,107 +4,677 @@ Based on original work by Humam Kourani and Alessandro Berti
 """
 
 import os
+import re
 import json
-import requests
-import tempfile
-from typing import Optional, Dict, Any
+import time
+import random
+import asyncio
+import hashlib
+import functools
+import threading
+import importlib.util
+import xml.etree.ElementTree as ET
+from typing import Optional, Dict, Any, Tuple, Callable, Iterator, List
+from xml.sax.saxutils import quoteattr
 import streamlit as st
 
-# Import AI libraries conditionally
+# The provider SDKs, pm4py and httpx are slow to import, so they are
+# imported on first use (see _initialize_client, _get_pm4py, _http_client)
 try:
-    import openai
+    import diskcache
 except ImportError:
-    openai = None
+    diskcache = None
 
 try:
-    import anthropic
+    import orjson
 except ImportError:
-    anthropic = None
+    orjson = None
 
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+# Directory for on-disk caches (data/ is mounted as a volume in docker-compose)
+CACHE_DIR = os.getenv("PROMOAI_CACHE_DIR", os.path.join("data", "cache"))
 
-try:
-    import cohere
-except ImportError:
-    cohere = None
 
-# Import process mining libraries
-try:
-    import pm4py
-    from pm4py.objects.bpmn.obj import BPMN
-    from pm4py.objects.petri_net.obj import PetriNet, Marking
-    from pm4py.objects.petri_net.utils import petri_utils
-except ImportError:
-    pm4py = None
-    BPMN = None
-    PetriNet = None
-    Marking = None
-    petri_utils = None
+@functools.lru_cache(maxsize=1)
+def _get_pm4py():
+    """Import pm4py once per process, or return None if it isn't installed"""
+    try:
+        import pm4py
+    except ImportError:
+        return None
+    return pm4py
+
+
+# One pooled HTTP client shared by the OpenAI and Anthropic SDKs, so repeated
+# calls reuse warm connections instead of redoing the TCP/TLS handshake
+@functools.lru_cache(maxsize=1)
+def _http_client():
+    """Create the shared httpx client once per process, or None without httpx"""
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return httpx.Client(
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=60,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40)
+    )
+
+
+def _loads(data) -> Any:
+    """Parse JSON, with orjson when installed"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """Serialize to compact UTF-8 JSON, with orjson when installed"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    # Same bytes as orjson, so cache keys match whether or not it is installed
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+# Sampling settings shared by all providers
+_TEMPERATURE = 0.3
+_MAX_TOKENS = 2000
+# Output budgets per task; output length dominates latency, so prompts ask for compact output
+_BPMN_MAX_TOKENS = 1200
+# Rewriting an existing model (refinement prompts embed the whole model) needs
+# room for the model itself; XML averages roughly 3 characters per token
+_EMBEDDED_MODEL_RE = re.compile(r"<(?:\w+:)?definitions\b.*?</(?:\w+:)?definitions>", re.S)
+_XML_CHARS_PER_TOKEN = 3
+_REWRITE_MAX_TOKENS = 4096
+_PETRI_MAX_TOKENS = 600
+
+# Smaller, faster models for the simple Petri net JSON task;
+# set PROMOAI_FAST_PETRI_MODEL=false to use the selected model instead
+FAST_PETRI_MODEL = os.getenv("PROMOAI_FAST_PETRI_MODEL", "true").lower() == "true"
+_FAST_MODELS = {
+    "OpenAI": "gpt-4o-mini",
+    "Anthropic": "claude-3-5-haiku-latest",
+    "Google": "gemini-1.5-flash",
+    "Cohere": "command-light",
+}
+
+# Transient provider errors (rate limits, server errors, network issues) are
+# retried with exponential backoff before falling back to another provider
+_MAX_ATTEMPTS = 3
+_RETRY_BASE_DELAY = 1.0
+_TRANSIENT_STATUS = {408, 409, 429}
+_TRANSIENT_NAMES = (
+    "RateLimit", "Timeout", "Connection", "InternalServer", "ServiceUnavailable",
+    "Overloaded", "ResourceExhausted", "TooManyRequests", "DeadlineExceeded"
+)
+
+# Concurrent requests per provider across all sessions of this process
+_PROVIDER_CONCURRENCY = int(os.getenv("PROMOAI_PROVIDER_CONCURRENCY", "8"))
+_PROVIDER_SLOTS: Dict[str, threading.BoundedSemaphore] = {}
+_PROVIDER_SLOTS_LOCK = threading.Lock()
+
+
+def _provider_slot(provider: str) -> threading.BoundedSemaphore:
+    """Semaphore limiting concurrent requests to a provider"""
+    with _PROVIDER_SLOTS_LOCK:
+        if provider not in _PROVIDER_SLOTS:
+            _PROVIDER_SLOTS[provider] = threading.BoundedSemaphore(_PROVIDER_CONCURRENCY)
+        return _PROVIDER_SLOTS[provider]
+
+
+def _with_retries(call: Callable[[], Any]) -> Any:
+    """Run call, retrying transient errors with exponential backoff and jitter"""
+    for attempt in range(_MAX_ATTEMPTS):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == _MAX_ATTEMPTS - 1 or not _is_transient(e):
+                raise
+            time.sleep(_RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, _RETRY_BASE_DELAY))
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a provider error is worth retrying"""
+    # SDK errors expose the HTTP status as status_code (OpenAI, Anthropic, Cohere) or code (Google)
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in _TRANSIENT_STATUS or status >= 500
+    return any(name in cls.__name__ for cls in type(error).__mro__ for name in _TRANSIENT_NAMES)
+
+
+# Static instructions go in the system prompt, shared by every request. At a few
+# hundred tokens these prompts are below the provider prompt-caching minimums
+# (1024 tokens for OpenAI, 1024-2048 for Anthropic), so they are not cached yet
+_SYSTEM_PROMPT = "You are a process modeling expert that converts text descriptions into formal process models."
+
+# A tiny (description, BPMN XML) pair showing the exact minified output expected,
+# so smaller, faster models get the format right and don't pad their answers
+_BPMN_FEWSHOT = (
+    (
+        "A user registers. If the email address is valid the account is activated, "
+        "otherwise the registration is rejected.",
+        '<definitions xmlns="http://www.omg.org/spec/BPMN/20100524/MODEL" id="d1" '
+        'targetNamespace="http://bpmn.io/schema/bpmn"><process id="p1" isExecutable="false">'
+        '<startEvent id="e1"/><task id="t1" name="Register user"/>'
+        '<exclusiveGateway id="g1" name="Email valid?"/><task id="t2" name="Activate account"/>'
+        '<task id="t3" name="Reject registration"/><exclusiveGateway id="g2"/><endEvent id="e2"/>'
+        '<sequenceFlow id="f1" sourceRef="e1" targetRef="t1"/><sequenceFlow id="f2" sourceRef="t1" targetRef="g1"/>'
+        '<sequenceFlow id="f3" name="yes" sourceRef="g1" targetRef="t2"/>'
+        '<sequenceFlow id="f4" name="no" sourceRef="g1" targetRef="t3"/>'
+        '<sequenceFlow id="f5" sourceRef="t2" targetRef="g2"/><sequenceFlow id="f6" sourceRef="t3" targetRef="g2"/>'
+        '<sequenceFlow id="f7" sourceRef="g2" targetRef="e2"/></process></definitions>'
+    ),
+)
+
+_BPMN_SYSTEM = _SYSTEM_PROMPT + """
+
+Convert the process description you are given into BPMN 2.0 XML.
+
+Please provide a valid BPMN 2.0 XML that includes:
+- Start and end events
+- Tasks/activities
+- Gateways (if needed)
+- Sequence flows
+
+Output minified BPMN XML: no whitespace between tags, no XML comments, and short
+IDs of the form e1 (events), t1 (tasks), g1 (gateways), f1 (sequence flows).
+
+Return only the XML code without any explanation.""" + "".join(
+    f"\n\nExample description:\n{description}\nExample output:\n{xml}" for description, xml in _BPMN_FEWSHOT
+)
+
+_PETRI_SYSTEM = _SYSTEM_PROMPT + """
+
+Convert the process description you are given into a Petri Net structure.
+
+Provide the Petri Net as a structured JSON with:
+- places: list of place names
+- transitions: list of transition names
+- arcs: list of arcs with source and target
+
+Use compact JSON without indentation. Return only valid JSON without any explanation."""
+
+# Per-request user prompts, filled with str.format. Variable parts are ordered
+# from most to least stable (instructions before the description) so repeated
+# requests share a long prefix; this only pays off for provider-side prompt
+# caching once the shared prefix exceeds the provider minimum (1024+ tokens)
+_BPMN_TMPL = "{extra}Convert the following process description into a BPMN 2.0 XML format:\n\n{description}\n"
+_EXTRA_TMPL = "Additional instructions:\n{instructions}\n\n"
+_PETRI_TMPL = "Convert the following process description into a Petri Net structure:\n\n{description}\n"
+
+# Exact-match AI response cache: diskcache when installed, else a bounded in-process dict
+_RESPONSE_TTL = 24 * 60 * 60
+_RESPONSE_CACHE_MAX = 256
+_RESPONSE_CACHE: Dict[str, Tuple[float, str]] = {}
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _disk_cache():
+    """Open the on-disk response cache once per process, or None if unavailable"""
+    if not diskcache:
+        return None
+    try:
+        return diskcache.Cache(os.path.join(CACHE_DIR, "responses"))
+    except Exception:
+        return None
+
+
+def _cache_get(key: str) -> Optional[str]:
+    """Look up a cached AI response"""
+    disk = _disk_cache()
+    if disk is not None:
+        return disk.get(key)
+    with _RESPONSE_CACHE_LOCK:
+        entry = _RESPONSE_CACHE.get(key)
+    if entry and entry[0] > time.time():
+        return entry[1]
+    return None
+
+
+def _cache_set(key: str, text: str) -> None:
+    """Store an AI response for _RESPONSE_TTL seconds"""
+    disk = _disk_cache()
+    if disk is not None:
+        disk.set(key, text, expire=_RESPONSE_TTL)
+        return
+    with _RESPONSE_CACHE_LOCK:
+        if key not in _RESPONSE_CACHE and len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_MAX:
+            # Evict the oldest insertion
+            _RESPONSE_CACHE.pop(next(iter(_RESPONSE_CACHE)))
+        _RESPONSE_CACHE[key] = (time.time() + _RESPONSE_TTL, text)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize_prompt(prompt: str) -> str:
+    """Collapse runs of whitespace so prompts differing only in spacing share a cache entry
+    
+    Purely textual; it does not detect prompts that differ in wording.
+    """
+    return _WHITESPACE_RE.sub(" ", prompt).strip()
+
+
+# Patterns for cleaning AI XML responses, compiled once
+_XML_FENCE_RE = re.compile(r"```xml\b\s*(.*?)(?:```|$)", re.S | re.I)
+_FENCE_RE = re.compile(r"```\w*\s*(.*?)(?:```|$)", re.S)
+_SINGLE_QUOTED_ATTR_RE = re.compile(r"(\w+)='([^']*)'")
+_SCHEMA_LOCATION_RE = re.compile(r'\s+xsi:schemaLocation="[^"]*"')
+# Attributes delimited by curly quotes; quotes inside values (e.g. German „…“) are left alone
+_CURLY_DOUBLE_ATTR_RE = re.compile(r'(\s[\w:.-]+)=[“”]([^"“”<>]*)[“”]')
+_CURLY_SINGLE_ATTR_RE = re.compile(r"(\s[\w:.-]+)=[‘’]([^'‘’<>]*)[‘’]")
+_XML_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_BARE_AMPERSAND_RE = re.compile(r"&(?!(?:[A-Za-z]+|#\d+|#x[0-9A-Fa-f]+);)")
+
+# BPMN 2.0 namespaces, registered so repaired models keep the usual prefixes
+_BPMN_NS = "http://www.omg.org/spec/BPMN/20100524/MODEL"
+_BPMN_NAMESPACES = {
+    "bpmn": _BPMN_NS,
+    "bpmndi": "http://www.omg.org/spec/BPMN/20100524/DI",
+    "dc": "http://www.omg.org/spec/DD/20100524/DC",
+    "di": "http://www.omg.org/spec/DD/20100524/DI",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+}
+for _prefix, _uri in _BPMN_NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+_DEFAULT_TARGET_NS = "http://bpmn.io/schema/bpmn"
+
+
+def _local_name(tag: str) -> str:
+    """Tag name without its {namespace} prefix"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _repair_bpmn_xml(xml_text: str) -> str:
+    """Check a generated BPMN model locally and fix common defects instead of asking the AI again
+    
+    Escapes bare ampersands, moves elements without a namespace into the BPMN
+    namespace, wraps a lone process in definitions, adds a missing
+    targetNamespace and drops sequence flows that reference unknown elements.
+    The text is returned unchanged if nothing needed fixing or it can't be parsed.
+    """
+    repaired = False
+    # Parse the str itself: encoding it to bytes would clash with a declared
+    # non-UTF-8 encoding (e.g. ISO-8859-1) and garble umlauts
+    try:
+        root = ET.fromstring(xml_text)
+    except ET.ParseError:
+        try:
+            root = ET.fromstring(_BARE_AMPERSAND_RE.sub("&amp;", xml_text))
+        except ET.ParseError:
+            return xml_text
+        repaired = True
+    
+    if _local_name(root.tag) not in ("process", "definitions"):
+        return xml_text
+    
+    # Tools only recognize BPMN elements in the BPMN namespace
+    if not root.tag.startswith("{"):
+        for element in root.iter():
+            if not element.tag.startswith("{"):
+                element.tag = f"{{{_BPMN_NS}}}{element.tag}"
+        repaired = True
+    
+    if _local_name(root.tag) == "process":
+        namespace = root.tag[1:].split("}", 1)[0]
+        definitions = ET.Element(f"{{{namespace}}}definitions", {"id": "d1"})
+        definitions.append(root)
+        root = definitions
+        repaired = True
+    
+    if not root.get("targetNamespace"):
+        root.set("targetNamespace", _DEFAULT_TARGET_NS)
+        repaired = True
+    
+    # Sequence flows must connect existing elements; drop dangling ones along
+    # with their incoming/outgoing references and diagram edges
+    ids = {element.get("id") for element in root.iter() if element.get("id")}
+    dangling = set()
+    for parent in root.iter():
+        for child in list(parent):
+            if (_local_name(child.tag) == "sequenceFlow"
+                    and (child.get("sourceRef") not in ids or child.get("targetRef") not in ids)):
+                parent.remove(child)
+                dangling.add(child.get("id"))
+    if dangling:
+        for parent in root.iter():
+            for child in list(parent):
+                name = _local_name(child.tag)
+                if ((name in ("incoming", "outgoing") and (child.text or "").strip() in dangling)
+                        or (name == "BPMNEdge" and child.get("bpmnElement") in dangling)):
+                    parent.remove(child)
+        repaired = True
+    
+    if not repaired:
+        return xml_text
+    return _XML_HEAD + ET.tostring(root, encoding="unicode")
+
+
+def _response_key(ai: "ProMoAI", prompt: str, system: str, max_tokens: int,
+                  json_mode: bool = False, model: Optional[str] = None) -> str:
+    """Cache key for an AI request: hash of provider, model, prompt and settings"""
+    request = {
+        "provider": ai.provider,
+        "model": model or ai.model,
+        "prompt": _normalize_prompt(prompt),
+        "system": system,
+        "temperature": _TEMPERATURE,
+        "max_tokens": max_tokens,
+        "json_mode": json_mode,
+    }
+    return hashlib.sha256(_dumps(request, sort_keys=True)).hexdigest()
+
+
+def _cached_response(func):
+    """Serve repeated requests with identical provider, model, prompt and settings from cache"""
+    @functools.wraps(func)
+    def wrapper(self, prompt: str, **kwargs) -> str:
+        key = _response_key(self, prompt, **kwargs)
+        
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+        
+        text = func(self, prompt, **kwargs)
+        # Empty text means the provider call failed; don't cache it
+        if text:
+            _cache_set(key, text)
+        return text
+    return wrapper
+
+
+# Semantic cache for paraphrased descriptions. Opt-in, since it loads a
+# sentence-embedding model (requires the sentence-transformers package).
+SEMANTIC_CACHE_ENABLED = os.getenv("PROMOAI_SEMANTIC_CACHE", "false").lower() == "true"
+_SEMANTIC_MODEL = os.getenv("PROMOAI_SEMANTIC_MODEL", "all-MiniLM-L6-v2")
+_SEMANTIC_THRESHOLD = 0.92
+# Embedding models truncate long inputs, so long prompts (e.g. refinements
+# that embed a whole model) would match on their shared prefix; skip them
+_SEMANTIC_MAX_CHARS = 1000
+
+
+class _SemanticCache:
+    """Cosine-similarity lookup of earlier results, partitioned by scope"""
+    
+    def __init__(self, model_name: str, threshold: float, max_entries: int = 512):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._encoder = None
+        self._available = True
+        self._entries: Dict[tuple, Tuple[list, list]] = {}
+        # Guards _entries only; encoding runs outside it so sessions don't queue
+        self._lock = threading.Lock()
+        self._encoder_lock = threading.Lock()
+    
+    def _embed(self, text: str):
+        """Return a unit-length embedding, or None if no encoder is available"""
+        if self._encoder is None:
+            # Load the model once, even if several threads ask at the same time
+            with self._encoder_lock:
+                if self._encoder is None:
+                    if not self._available:
+                        return None
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                        self._encoder = SentenceTransformer(self.model_name)
+                    except Exception:
+                        self._available = False
+                        return None
+        return self._encoder.encode(text, normalize_embeddings=True)
+    
+    def get(self, scope: tuple, text: str) -> Tuple[Optional[Any], Any]:
+        """Return (the stored value most similar to text if it clears the threshold, embedding of text)
+        
+        Pass the embedding on to put() so the text isn't encoded twice.
+        """
+        import numpy as np
+        vector = self._embed(text)
+        if vector is None:
+            return None, None
+        with self._lock:
+            vectors, values = self._entries.get(scope, ([], []))
+            vectors, values = list(vectors), list(values)
+        if not vectors:
+            return None, vector
+        scores = np.stack(vectors) @ vector
+        best = int(np.argmax(scores))
+        return (values[best] if scores[best] >= self.threshold else None), vector
+    
+    def put(self, scope: tuple, vector: Any, value: Any) -> None:
+        """Store value under an embedding returned by get()"""
+        if vector is None:
+            return
+        with self._lock:
+            vectors, values = self._entries.setdefault(scope, ([], []))
+            if len(vectors) >= self.max_entries:
+                vectors.pop(0)
+                values.pop(0)
+            vectors.append(vector)
+            values.append(value)
+
+
+_SEMANTIC_CACHE = _SemanticCache(_SEMANTIC_MODEL, _SEMANTIC_THRESHOLD) if SEMANTIC_CACHE_ENABLED else None
+
+
+# Rule-based fast path: purely sequential descriptions are modeled locally
+# without an AI call; set PROMOAI_RULEBASED=false to always use the AI
+RULEBASED_ENABLED = os.getenv("PROMOAI_RULEBASED", "true").lower() == "true"
+_RULEBASED_MAX_STEPS = 7
+_RULEBASED_MAX_STEP_CHARS = 80
+_LIST_ITEM_RE = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+(.+?)\s*$")
+# Sequence words only count at the start of a clause (after punctuation or "and"),
+# so adjectives ("next steps") and mid-clause adverbs ("wird dann geprüft") don't split
+_SEQUENCE_SPLIT_RE = re.compile(
+    r"\s*(?:->|→|=>|(?:[,;.]|\b(?:and|und)\b)\s*\b(?:then|next|afterwards|dann|danach|anschließend)\b)\s*",
+    re.IGNORECASE
+)
+# Wording that implies branching, concurrency or loops, which the fast path can't model
+_NON_LINEAR_RE = re.compile(
+    r"[:?]|\b(?:if|else|otherwise|or|either|unless|when|while|until|parallel|simultaneously|"
+    r"wenn|falls|bei|oder|sonst|ansonsten|während|solange|bis|parallel|gleichzeitig)\b",
+    re.IGNORECASE
+)
+
+
+def _parse_linear_steps(description: str) -> Optional[List[str]]:
+    """Return the activities of a purely sequential description, or None"""
+    lines = [line for line in description.strip().splitlines() if line.strip()]
+    if len(lines) > 1:
+        # Numbered or bulleted list, one activity per line
+        matches = [_LIST_ITEM_RE.match(line) for line in lines]
+        if not all(matches):
+            return None
+        steps = [match.group(1) for match in matches]
+    elif lines:
+        # Single line chained with arrows or "then"
+        steps = _SEQUENCE_SPLIT_RE.split(lines[0])
+    else:
+        return None
+    
+    steps = [step.strip().rstrip(".,;").strip() for step in steps]
+    if not 2 <= len(steps) <= _RULEBASED_MAX_STEPS:
+        return None
+    for step in steps:
+        if not step or len(step) > _RULEBASED_MAX_STEP_CHARS or _NON_LINEAR_RE.search(step):
+            return None
+    return steps
+
+
+def _linear_bpmn_xml(steps: List[str]) -> str:
+    """Minified BPMN 2.0 XML for a start event, the steps in order, and an end event"""
+    nodes = ['<startEvent id="e1"/>']
+    nodes += [f'<task id="t{i}" name={quoteattr(step)}/>' for i, step in enumerate(steps, 1)]
+    nodes.append('<endEvent id="e2"/>')
+    refs = ["e1"] + [f"t{i}" for i in range(1, len(steps) + 1)] + ["e2"]
+    flows = [
+        f'<sequenceFlow id="f{i}" sourceRef="{source}" targetRef="{target}"/>'
+        for i, (source, target) in enumerate(zip(refs, refs[1:]), 1)
+    ]
+    return (
+        _XML_HEAD
+        + '<definitions xmlns="http://www.omg.org/spec/BPMN/20100524/MODEL" id="d1" '
+        'targetNamespace="http://bpmn.io/schema/bpmn"><process id="p1" isExecutable="false">'
+        + "".join(nodes) + "".join(flows)
+        + "</process></definitions>"
+    )
+
+
+def _linear_petri_net(steps: List[str]) -> Optional[Dict[str, Any]]:
+    """Petri Net JSON structure for the steps in order, with a place between each pair
+    
+    Arcs refer to places and transitions by name, so None is returned if a step
+    name repeats or collides with a place name.
+    """
+    places = ["start"] + [f"p{i}" for i in range(1, len(steps))] + ["end"]
+    if len(set(steps)) < len(steps) or set(steps) & set(places):
+        return None
+    arcs = []
+    for i, step in enumerate(steps):
+        arcs.append({"source": places[i], "target": step})
+        arcs.append({"source": step, "target": places[i + 1]})
+    return {"places": places, "transitions": list(steps), "arcs": arcs}
+
+
+class _StreamInterrupted(Exception):
+    """A streamed AI response broke off after part of it was delivered"""
+
+
+class _TruncatedResponse(Exception):
+    """The provider stopped generating because it hit the max_tokens limit"""
+    
+    def __init__(self, max_tokens: int):
+        super().__init__(f"Response was cut off at the {max_tokens}-token output limit")
+
+
+def _bpmn_output_budget(description: str) -> int:
+    """max_tokens for a BPMN request, enlarged when the prompt embeds a model to rewrite"""
+    match = _EMBEDDED_MODEL_RE.search(description)
+    if not match:
+        return _BPMN_MAX_TOKENS
+    # Allow a quarter more than the embedded model for additions from the feedback
+    needed = len(match.group(0)) // _XML_CHARS_PER_TOKEN * 5 // 4
+    return min(max(needed, _BPMN_MAX_TOKENS), _REWRITE_MAX_TOKENS)
+
+
+def _finish_reason_name(reason) -> Optional[str]:
+    """Provider finish reason as an upper-case string (Gemini uses an enum)"""
+    if reason is None:
+        return None
+    return str(getattr(reason, "name", reason)).upper()
 
 
 class ProMoAI:
     """Main ProMoAI class for process model generation"""
     
-    def __init__(self, provider: str, api_key: str, model: str):
+    def __init__(self, provider: str, api_key: str, model: str,
+                 fallbacks: Tuple[Tuple[str, str, str], ...] = ()):
+        """fallbacks are (provider, api_key, model) triples tried in order when a request fails"""
         self.provider = provider
         self.api_key = api_key
         self.model = model
+        self.fallbacks = tuple(fallbacks)
+        self.fast_model = _FAST_MODELS.get(provider, model) if FAST_PETRI_MODEL else model
         self.client = self._initialize_client()
     
+    @functools.cached_property
+    def _fallback_clients(self) -> list:
+        """ProMoAI instances for the fallback providers, created on first use"""
+        clients = []
+        for provider, api_key, model in self.fallbacks:
+            try:
+                clients.append(ProMoAI(provider, api_key, model))
+            except ValueError:
+                # SDK not installed; skip this fallback
+                continue
+        return clients
+    
     def _initialize_client(self):
         """Initialize the appropriate AI client based on provider"""
-        if self.provider == "OpenAI" and openai:
-            openai.api_key = self.api_key
-            return openai.OpenAI(api_key=self.api_key)
-        elif self.provider == "Anthropic" and anthropic:
-            return anthropic.Anthropic(api_key=self.api_key)
-        elif self.provider == "Google" and genai:
-            genai.configure(api_key=self.api_key)
-            return genai.GenerativeModel(self.model)
-        elif self.provider == "Cohere" and cohere:
-            return cohere.Client(self.api_key)
-        else:
-            raise ValueError(f"Provider {self.provider} not supported or library not installed")
+        try:
+            if self.provider == "OpenAI":
+                import openai
+                openai.api_key = self.api_key
+                # Retries are handled by _request, so the SDKs don't retry on their own
+                return openai.OpenAI(api_key=self.api_key, http_client=_http_client(), max_retries=0)
+            elif self.provider == "Anthropic":
+                import anthropic
+                return anthropic.Anthropic(api_key=self.api_key, http_client=_http_client(), max_retries=0)
+            elif self.provider == "Google":
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                return genai.GenerativeModel(self.model)
+            elif self.provider == "Cohere":
+                import cohere
+                return cohere.Client(self.api_key)
+        except ImportError:
+            pass
+        raise ValueError(f"Provider {self.provider} not supported or library not installed")
     
-    def generate_bpmn_from_text(self, description: str, custom_instructions: str = "") -> Dict[str, Any]:
-        """Generate BPMN model from text description"""
-        
-        # Create prompt for BPMN generation
-        base_prompt = f"""
-        Convert the following process description into a BPMN 2.0 XML format:
-        
-        {description}
+    def _semantic_scope(self, task: str, description: str, extra: str = "") -> Optional[tuple]:
+        """Semantic cache scope for a request, or None if the cache doesn't apply"""
+        if _SEMANTIC_CACHE is None or len(description) > _SEMANTIC_MAX_CHARS:
+            return None
+        return (self.provider, self.model, task, extra)
+    
+    def generate_bpmn_from_text(self, description: str, custom_instructions: str = "",
+                                stream_to: Optional[Callable[[Iterator[str]], str]] = None) -> Dict[str, Any]:
+        """Generate BPMN model from text description
         
-        Please provide a valid BPMN 2.0 XML that includes:
-        - Start and end events
-        - Tasks/activities
-        - Gateways (if needed)
-        - Sequence flows
+        If stream_to is given, it is called with an iterator of response chunks
+        (e.g. to render them live) and must return the concatenated text.
         """
         
-        # Add custom instructions if provided
-        if custom_instructions:
-            prompt = base_prompt + f"""
+        # Purely sequential descriptions don't need an AI call
+        if RULEBASED_ENABLED and not custom_instructions:
+            steps = _parse_linear_steps(description)
+            if steps:
+                return {
+                    "bpmn_xml": _linear_bpmn_xml(steps),
+                    "status": "success",
+                    "message": "BPMN model generated successfully"
+                }
         
-        Additional instructions:
-        {custom_instructions}
+        # Serve paraphrases of earlier descriptions from the semantic cache
+        scope = self._semantic_scope("bpmn", description, custom_instructions)
+        if scope:
+            cached_xml, embedding = _SEMANTIC_CACHE.get(scope, description)
+            if cached_xml is not None:
+                return {
+                    "bpmn_xml": cached_xml,
+                    "status": "success",
+                    "message": "BPMN model generated successfully"
+                }
         
-        Return only the XML code without any explanation.
-        """
-        else:
-            prompt = base_prompt + """
+        # Create prompt for BPMN generation; the static instructions are in _BPMN_SYSTEM
+        extra = _EXTRA_TMPL.format(instructions=custom_instructions) if custom_instructions else ""
+        prompt = _BPMN_TMPL.format(description=description, extra=extra)
+        max_tokens = _bpmn_output_budget(description)
         
-        Return only the XML code without any explanation.
-        """
+        # Get response from AI; a response cut off at max_tokens comes back empty
+        if stream_to:
+            stream = self._stream_ai_response(prompt, system=_BPMN_SYSTEM, max_tokens=max_tokens)
+            try:
+                response = stream_to(stream)
+            except _StreamInterrupted:
+                # Partial output; the error has already been reported
+                response = ""
+            finally:
+                # Frees the provider slot even if stream_to stopped reading early
+                stream.close()
+        else:
+            response = self._get_ai_response(prompt, system=_BPMN_SYSTEM, max_tokens=max_tokens)
         
-        # Get response from AI
-        bpmn_xml = self._get_ai_response(prompt)
+        if not response:
+            return {
+                "bpmn_xml": "",
+                "status": "error",
+                "message": "Failed to generate BPMN model"
+            }
         
         # Clean the response
-        bpmn_xml = self._clean_xml_response(bpmn_xml)
+        bpmn_xml = self._clean_xml_response(response)
+        
+        if scope:
+            _SEMANTIC_CACHE.put(scope, embedding, bpmn_xml)
         
         return {
             "bpmn_xml": bpmn_xml,
@@ -115,23 +685,36 @@ class ProMoAI:
     def generate_petri_net_from_text(self, description: str) -> Dict[str, Any]:
         """Generate Petri Net from text description"""
         
-        prompt = f"""
-        Convert the following process description into a Petri Net structure:
+        if RULEBASED_ENABLED:
+            steps = _parse_linear_steps(description)
+            petri_data = _linear_petri_net(steps) if steps else None
+            if petri_data:
+                return {
+                    "petri_data": petri_data,
+                    "status": "success",
+                    "message": "Petri Net generated successfully"
+                }
         
-        {description}
+        scope = self._semantic_scope("petri", description)
+        if scope:
+            cached_data, embedding = _SEMANTIC_CACHE.get(scope, description)
+            if cached_data is not None:
+                return {
+                    "petri_data": cached_data,
+                    "status": "success",
+                    "message": "Petri Net generated successfully"
+                }
         
-        Provide the Petri Net as a structured JSON with:
-        - places: list of place names
-        - transitions: list of transition names
-        - arcs: list of arcs with source and target
+        prompt = _PETRI_TMPL.format(description=description)
         
-        Return only valid JSON without any explanation.
-        """
-        
-        petri_json = self._get_ai_response(prompt)
+        petri_json = self._get_ai_response(prompt, system=_PETRI_SYSTEM, max_tokens=_PETRI_MAX_TOKENS,
+                                           json_mode=True, model=self.fast_model)
         
         try:
-            petri_data = json.loads(petri_json)
+            # orjson's JSONDecodeError subclasses json.JSONDecodeError
+            petri_data = _loads(petri_json)
+            if scope:
+                _SEMANTIC_CACHE.put(scope, embedding, petri_data)
             return {
                 "petri_data": petri_data,
                 "status": "success",
@@ -144,98 +727,405 @@ class ProMoAI:
                 "message": "Failed to parse Petri Net JSON"
             }
     
-    def _get_ai_response(self, prompt: str) -> str:
-        """Get response from the AI provider"""
-        try:
-            if self.provider == "OpenAI" and openai:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are a process modeling expert that converts text descriptions into formal process models."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=2000
-                )
-                return response.choices[0].message.content
-            
-            elif self.provider == "Anthropic" and anthropic:
-                response = self.client.messages.create(
-                    model=self.model,
-                    messages=[
+    async def agenerate_bpmn_from_text(self, description: str, custom_instructions: str = "") -> Dict[str, Any]:
+        """Async variant of generate_bpmn_from_text (the SDK call runs in a worker thread)"""
+        return await asyncio.to_thread(self.generate_bpmn_from_text, description, custom_instructions)
+    
+    async def agenerate_petri_net_from_text(self, description: str) -> Dict[str, Any]:
+        """Async variant of generate_petri_net_from_text (the SDK call runs in a worker thread)"""
+        return await asyncio.to_thread(self.generate_petri_net_from_text, description)
+    
+    async def generate_both(self, description: str, custom_instructions: str = "") -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Generate the BPMN model and the Petri Net concurrently; returns (bpmn_result, petri_result)"""
+        bpmn_result, petri_result = await asyncio.gather(
+            self.agenerate_bpmn_from_text(description, custom_instructions),
+            self.agenerate_petri_net_from_text(description),
+        )
+        return bpmn_result, petri_result
+    
+    def generate_bpmn_batch(self, descriptions: List[str], poll_interval: float = 30.0) -> List[Dict[str, Any]]:
+        """Generate BPMN models for many descriptions; results are in input order
+        
+        OpenAI and Anthropic requests go through their batch APIs, which are
+        discounted but may take up to 24 hours; this call blocks until the batch
+        finishes. Other providers, or a failing batch API, fall back to
+        concurrent individual requests.
+        """
+        if self.provider not in ("OpenAI", "Anthropic"):
+            return asyncio.run(self._agenerate_bpmn_many(descriptions))
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(descriptions)
+        prompts: Dict[str, str] = {}
+        for i, description in enumerate(descriptions):
+            steps = _parse_linear_steps(description) if RULEBASED_ENABLED else None
+            if steps:
+                results[i] = self._bpmn_result(_linear_bpmn_xml(steps))
+                continue
+            prompt = _BPMN_TMPL.format(description=description, extra="")
+            cached = _cache_get(_response_key(self, prompt, system=_BPMN_SYSTEM, max_tokens=_BPMN_MAX_TOKENS))
+            if cached is not None:
+                results[i] = self._bpmn_result(self._clean_xml_response(cached))
+            else:
+                prompts[str(i)] = prompt
+        
+        if prompts:
+            try:
+                if self.provider == "OpenAI":
+                    responses = self._openai_batch(prompts, poll_interval)
+                else:
+                    responses = self._anthropic_batch(prompts, poll_interval)
+            except Exception as e:
+                st.warning(f"Batch API unavailable, sending requests individually: {str(e)}")
+                pending = [int(custom_id) for custom_id in prompts]
+                for i, result in zip(pending, asyncio.run(self._agenerate_bpmn_many([descriptions[i] for i in pending]))):
+                    results[i] = result
+            else:
+                for custom_id, prompt in prompts.items():
+                    text = responses.get(custom_id)
+                    if not text:
+                        # Errored or expired in the batch
+                        results[int(custom_id)] = self._bpmn_result("")
+                        continue
+                    _cache_set(_response_key(self, prompt, system=_BPMN_SYSTEM, max_tokens=_BPMN_MAX_TOKENS), text)
+                    results[int(custom_id)] = self._bpmn_result(self._clean_xml_response(text))
+        
+        return results
+    
+    async def _agenerate_bpmn_many(self, descriptions: List[str]) -> List[Dict[str, Any]]:
+        """Run generate_bpmn_from_text for each description concurrently"""
+        return list(await asyncio.gather(*(self.agenerate_bpmn_from_text(d) for d in descriptions)))
+    
+    @staticmethod
+    def _bpmn_result(bpmn_xml: str) -> Dict[str, Any]:
+        """Result dict for a batch item"""
+        if not bpmn_xml:
+            return {"bpmn_xml": "", "status": "error", "message": "Failed to generate BPMN model"}
+        return {"bpmn_xml": bpmn_xml, "status": "success", "message": "BPMN model generated successfully"}
+    
+    def _openai_batch(self, prompts: Dict[str, str], poll_interval: float) -> Dict[str, str]:
+        """Run prompts through the OpenAI Batch API; returns custom_id -> response text"""
+        lines = [
+            _dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": _BPMN_SYSTEM},
                         {"role": "user", "content": prompt}
                     ],
-                    max_tokens=2000,
-                    temperature=0.3
-                )
-                return response.content[0].text
-            
-            elif self.provider == "Google" and genai:
-                response = self.client.generate_content(prompt)
-                return response.text
-            
-            elif self.provider == "Cohere" and cohere:
-                response = self.client.generate(
-                    model=self.model,
-                    prompt=prompt,
-                    max_tokens=2000,
-                    temperature=0.3
-                )
-                return response.generations[0].text
-            
+                    "temperature": _TEMPERATURE,
+                    "max_tokens": _BPMN_MAX_TOKENS
+                }
+            })
+            for custom_id, prompt in prompts.items()
+        ]
+        # The SDK clients don't retry on their own (see _initialize_client)
+        batch_file = _with_retries(lambda: self.client.files.create(
+            file=("bpmn_batch.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        ))
+        batch = _with_retries(lambda: self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        ))
+        batch_id = batch.id
+        try:
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = _with_retries(lambda: self.client.batches.retrieve(batch_id))
+        except Exception:
+            # The caller resends the prompts individually; don't leave this batch running and billing
+            try:
+                self.client.batches.cancel(batch_id)
+            except Exception:
+                pass
+            raise
+        
+        # Expired batches still return the requests that finished in time
+        if not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+        
+        responses = {}
+        output = _with_retries(lambda: self.client.files.content(batch.output_file_id))
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = _loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") == 200:
+                responses[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return responses
+    
+    def _anthropic_batch(self, prompts: Dict[str, str], poll_interval: float) -> Dict[str, str]:
+        """Run prompts through Anthropic Message Batches; returns custom_id -> response text"""
+        batch = _with_retries(lambda: self.client.messages.batches.create(
+            requests=[
+                {
+                    "custom_id": custom_id,
+                    "params": {
+                        "model": self.model,
+                        "system": [
+                            {"type": "text", "text": _BPMN_SYSTEM, "cache_control": {"type": "ephemeral"}}
+                        ],
+                        "messages": [
+                            {"role": "user", "content": prompt}
+                        ],
+                        "max_tokens": _BPMN_MAX_TOKENS,
+                        "temperature": _TEMPERATURE
+                    }
+                }
+                for custom_id, prompt in prompts.items()
+            ]
+        ))
+        batch_id = batch.id
+        try:
+            while batch.processing_status != "ended":
+                time.sleep(poll_interval)
+                batch = _with_retries(lambda: self.client.messages.batches.retrieve(batch_id))
+        except Exception:
+            # The caller resends the prompts individually; don't leave this batch running and billing
+            try:
+                self.client.messages.batches.cancel(batch_id)
+            except Exception:
+                pass
+            raise
+        
+        return {
+            entry.custom_id: entry.result.message.content[0].text
+            for entry in _with_retries(lambda: list(self.client.messages.batches.results(batch_id)))
+            if entry.result.type == "succeeded"
+        }
+    
+    def _get_ai_response(self, prompt: str, system: str = _SYSTEM_PROMPT,
+                         max_tokens: int = _MAX_TOKENS, json_mode: bool = False,
+                         model: Optional[str] = None) -> str:
+        """Get response from the AI provider (model defaults to self.model), trying the fallbacks if it fails"""
+        try:
+            return self._request(prompt, system=system, max_tokens=max_tokens, json_mode=json_mode, model=model)
+        except Exception as e:
+            error = e
+        
+        for fallback in self._fallback_clients:
+            try:
+                # Keep using the fast model for tasks that asked for one
+                fallback_model = fallback.fast_model if model and model != self.model else None
+                return fallback._request(prompt, system=system, max_tokens=max_tokens,
+                                         json_mode=json_mode, model=fallback_model)
+            except Exception as e:
+                error = e
+        
+        st.error(f"Error getting AI response: {str(error)}")
+        return ""
+    
+    @_cached_response
+    def _request(self, prompt: str, system: str, max_tokens: int, json_mode: bool = False,
+                 model: Optional[str] = None) -> str:
+        """Send one request, retrying transient errors with exponential backoff
+        
+        Cached per provider, so a fallback's answer is stored under the fallback's key.
+        """
+        def call():
+            with _provider_slot(self.provider):
+                return self._call_provider(prompt, system, max_tokens, json_mode, model)
+        return _with_retries(call)
+    
+    def _call_provider(self, prompt: str, system: str, max_tokens: int, json_mode: bool,
+                       model: Optional[str]) -> str:
+        """Make a single provider API call; errors propagate to the caller"""
+        model = model or self.model
+        if self.provider == "OpenAI":
+            # OpenAI caches shared prefixes of 1024+ tokens automatically
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=_TEMPERATURE,
+                max_tokens=max_tokens,
+                # JSON mode keeps the model from wrapping JSON in prose
+                **({"response_format": {"type": "json_object"}} if json_mode else {})
+            )
+            if response.choices[0].finish_reason == "length":
+                raise _TruncatedResponse(max_tokens)
+            return response.choices[0].message.content
+        
+        elif self.provider == "Anthropic":
+            # Mark the static system prompt for Anthropic's prompt cache; this only
+            # takes effect once the prompt reaches the model's minimum cacheable length
+            response = self.client.messages.create(
+                model=model,
+                system=[
+                    {"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}
+                ],
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=_TEMPERATURE
+            )
+            if response.stop_reason == "max_tokens":
+                raise _TruncatedResponse(max_tokens)
+            return response.content[0].text
+        
+        elif self.provider == "Google":
+            # The Gemini client is bound to a model, so other models need their own
+            if model == self.model:
+                client = self.client
             else:
-                return "Provider not properly configured"
+                import google.generativeai as genai
+                client = genai.GenerativeModel(model)
+            response = client.generate_content(
+                f"{system}\n\n{prompt}",
+                generation_config={"temperature": _TEMPERATURE, "max_output_tokens": max_tokens}
+            )
+            if response.candidates and _finish_reason_name(response.candidates[0].finish_reason) == "MAX_TOKENS":
+                raise _TruncatedResponse(max_tokens)
+            return response.text
+        
+        elif self.provider == "Cohere":
+            response = self.client.generate(
+                model=model,
+                prompt=f"{system}\n\n{prompt}",
+                max_tokens=max_tokens,
+                temperature=_TEMPERATURE
+            )
+            if _finish_reason_name(getattr(response.generations[0], "finish_reason", None)) == "MAX_TOKENS":
+                raise _TruncatedResponse(max_tokens)
+            return response.generations[0].text
+        
+        else:
+            return "Provider not properly configured"
+    
+    def _stream_ai_response(self, prompt: str, system: str = _SYSTEM_PROMPT,
+                            max_tokens: int = _MAX_TOKENS) -> Iterator[str]:
+        """Yield the AI response in chunks as the provider produces them
+        
+        Raises _StreamInterrupted if the provider fails after chunks were yielded.
+        
+        The provider concurrency slot is held while the stream is open, including
+        while the generator is paused, so callers must consume it fully or close() it.
+        """
+        key = _response_key(self, prompt, system=system, max_tokens=max_tokens)
+        cached = _cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        if self.provider not in ("OpenAI", "Anthropic", "Google"):
+            # No streaming support wired up; deliver the whole response at once
+            yield self._get_ai_response(prompt, system=system, max_tokens=max_tokens)
+            return
+        
+        chunks = []
+        try:
+            with _provider_slot(self.provider):
+                if self.provider == "OpenAI":
+                    stream = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=_TEMPERATURE,
+                        max_tokens=max_tokens,
+                        stream=True
+                    )
+                    for event in stream:
+                        if event.choices and event.choices[0].delta.content:
+                            chunks.append(event.choices[0].delta.content)
+                            yield chunks[-1]
+                        if event.choices and event.choices[0].finish_reason == "length":
+                            raise _TruncatedResponse(max_tokens)
                 
+                elif self.provider == "Anthropic":
+                    with self.client.messages.stream(
+                        model=self.model,
+                        system=[
+                            {"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}
+                        ],
+                        messages=[
+                            {"role": "user", "content": prompt}
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=_TEMPERATURE
+                    ) as stream:
+                        for text in stream.text_stream:
+                            chunks.append(text)
+                            yield text
+                        if stream.get_final_message().stop_reason == "max_tokens":
+                            raise _TruncatedResponse(max_tokens)
+                
+                elif self.provider == "Google":
+                    for event in self.client.generate_content(
+                        f"{system}\n\n{prompt}",
+                        generation_config={"temperature": _TEMPERATURE, "max_output_tokens": max_tokens},
+                        stream=True
+                    ):
+                        chunks.append(event.text)
+                        yield event.text
+                        if (event.candidates
+                                and _finish_reason_name(event.candidates[0].finish_reason) == "MAX_TOKENS"):
+                            raise _TruncatedResponse(max_tokens)
+        
         except Exception as e:
-            st.error(f"Error getting AI response: {str(e)}")
-            return ""
+            if chunks or not (_is_transient(e) or self._fallback_clients):
+                st.error(f"Error getting AI response: {str(e)}")
+                if chunks:
+                    raise _StreamInterrupted(str(e)) from e
+                return
+            # Nothing shown yet, so retry without streaming (with backoff and fallbacks)
+            text = self._get_ai_response(prompt, system=system, max_tokens=max_tokens)
+            if text:
+                yield text
+            return
+        
+        text = "".join(chunks)
+        if text:
+            _cache_set(key, text)
     
     def _clean_xml_response(self, xml_text: str) -> str:
         """Clean XML response from AI"""
-        # Remove markdown code blocks if present
-        if "```xml" in xml_text:
-            xml_text = xml_text.split("```xml")[1].split("```")[0]
-        elif "```" in xml_text:
-            xml_text = xml_text.split("```")[1].split("```")[0]
+        # Take the body of a markdown code block if present, preferring an xml
+        # block over others (an unterminated block runs to the end of the text)
+        match = _XML_FENCE_RE.search(xml_text) or _FENCE_RE.search(xml_text)
+        if match:
+            xml_text = match.group(1)
         
         # Remove any leading/trailing whitespace
         xml_text = xml_text.strip()
         
-        # Fix common XML issues
-        import re
-        
-        # Replace curly quotes with straight quotes
-        xml_text = xml_text.replace('"', '"').replace('"', '"')
-        xml_text = xml_text.replace(''', "'").replace(''', "'")
+        # Replace curly attribute delimiters with straight quotes
+        xml_text = _CURLY_DOUBLE_ATTR_RE.sub(r'\1="\2"', xml_text)
+        xml_text = _CURLY_SINGLE_ATTR_RE.sub(r'\1="\2"', xml_text)
         
         # Fix attribute quotes - ensure all attributes use double quotes
-        xml_text = re.sub(r"(\w+)='([^']*)'", r'\1="\2"', xml_text)
+        xml_text = _SINGLE_QUOTED_ATTR_RE.sub(r'\1="\2"', xml_text)
+        
+        # Drop schemaLocation boilerplate; it is not needed to parse the model
+        xml_text = _SCHEMA_LOCATION_RE.sub('', xml_text)
         
         # Ensure it starts with <?xml
         if not xml_text.startswith("<?xml"):
-            xml_text = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_text
+            xml_text = _XML_HEAD + xml_text
         
-        return xml_text
+        # Fix what can be fixed locally rather than with another AI round trip
+        return _repair_bpmn_xml(xml_text)
     
-    def visualize_bpmn(self, bpmn_xml: str):
+    @staticmethod
+    def visualize_bpmn(bpmn_xml: str):
         """Visualize BPMN model using pm4py"""
-        if not pm4py:
+        if not _get_pm4py():
             st.error("pm4py library not installed. Cannot visualize BPMN.")
             return None
         
         try:
-            # Save XML to temporary file
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.bpmn', delete=False) as f:
-                f.write(bpmn_xml)
-                temp_path = f.name
-            
-            # Import BPMN using pm4py
-            bpmn_graph = pm4py.read_bpmn(temp_path)
-            
-            # Clean up temp file
-            os.unlink(temp_path)
-            
-            return bpmn_graph
+            # Parse the XML in memory rather than round-tripping through a temp file
+            from pm4py.objects.bpmn.importer import importer as bpmn_importer
+            return bpmn_importer.deserialize(bpmn_xml)
             
         except Exception as e:
             st.error(f"Error visualizing BPMN: {str(e)}")
@@ -246,8 +1136,119 @@ class ProMoAI:
         return bpmn_xml.encode('utf-8')
 
 
-def analyze_event_log(file_path: str) -> Dict[str, Any]:
-    """Analyze event log and extract process information"""
+# Columns process discovery needs; other event attributes are dropped right after reading
+_LOG_COLUMNS = ("case:concept:name", "concept:name", "time:timestamp")
+
+
+def _read_event_log(file_path: str):
+    """Read an event log into a pandas DataFrame, or None for unsupported formats"""
+    pm4py = _get_pm4py()
+    path = file_path.lower()
+    if path.endswith(('.xes', '.xes.gz')):
+        # The Rust-based importer is several times faster than the XML parsers
+        try:
+            log = pm4py.read_xes(file_path, variant="rustxes")
+        except ImportError:
+            log = pm4py.read_xes(file_path)
+        return log[[column for column in _LOG_COLUMNS if column in log.columns]]
+    elif path.endswith('.csv'):
+        import pandas as pd
+        # Only parse the discovery columns; the header read is cheap
+        header = pd.read_csv(file_path, nrows=0).columns
+        usecols = [column for column in header if column in _LOG_COLUMNS]
+        try:
+            df = pd.read_csv(file_path, engine="pyarrow", usecols=usecols)
+        except ImportError:
+            df = pd.read_csv(file_path, usecols=usecols)
+        return pm4py.format_dataframe(df)
+    return None
+
+
+# Size limit of the Parquet event log cache; least recently used logs are removed first
+_LOG_CACHE_MAX_BYTES = int(os.getenv("PROMOAI_LOG_CACHE_MB", "512")) * 1024 * 1024
+
+
+def _log_cache_path(cache_key: str) -> str:
+    """Path of the cached Parquet copy of an event log"""
+    return os.path.join(CACHE_DIR, f"{cache_key}.parquet")
+
+
+def is_event_log_cached(cache_key: str) -> bool:
+    """Whether a parsed copy of the event log with this content hash is cached"""
+    return os.path.exists(_log_cache_path(cache_key))
+
+
+def _prune_log_cache() -> None:
+    """Delete the least recently used cached logs until the cache fits _LOG_CACHE_MAX_BYTES"""
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".parquet") and entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= _LOG_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _load_event_log(file_path: Optional[str], cache_key: Optional[str] = None):
+    """Read an event log, reusing a Parquet copy stored under its content hash
+    
+    Returns None if file_path is None and the log isn't cached.
+    """
+    if not cache_key:
+        return _read_event_log(file_path)
+    
+    parquet_path = _log_cache_path(cache_key)
+    if os.path.exists(parquet_path):
+        import pandas as pd
+        try:
+            log = pd.read_parquet(parquet_path)
+        except OSError:
+            # Pruned in the meantime; parse the file again
+            log = None
+        if log is not None:
+            # Mark as recently used so pruning keeps it
+            try:
+                os.utime(parquet_path)
+            except OSError:
+                pass
+            return log
+    
+    if file_path is None:
+        return None
+    
+    log = _read_event_log(file_path)
+    if log is not None:
+        # Best effort: write to a temp name first so readers never see a partial file
+        tmp_path = f"{parquet_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            log.to_parquet(tmp_path)
+            os.replace(tmp_path, parquet_path)
+            _prune_log_cache()
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    return log
+
+
+def analyze_event_log(file_path: Optional[str], cache_key: Optional[str] = None) -> Dict[str, Any]:
+    """Analyze event log and extract process information
+    
+    If cache_key (e.g. a SHA-256 of the file content) is given, the parsed log
+    is cached as Parquet so repeated uploads of the same log skip parsing.
+    file_path may be None when is_event_log_cached(cache_key) is true.
+    """
+    pm4py = _get_pm4py()
     if not pm4py:
         return {
             "status": "error",
@@ -256,29 +1257,28 @@ def analyze_event_log(file_path: str) -> Dict[str, Any]:
     
     try:
         # Read event log
-        if file_path.endswith('.xes'):
-            log = pm4py.read_xes(file_path)
-        elif file_path.endswith('.csv'):
-            log = pm4py.read_csv(file_path)
-        else:
+        log = _load_event_log(file_path, cache_key)
+        if log is None:
             return {
                 "status": "error",
-                "message": "Unsupported file format"
+                "message": "Unsupported file format" if file_path else "Event log not cached"
             }
         
         # Get basic statistics
-        num_traces = len(log)
-        num_events = sum(len(trace) for trace in log)
+        num_traces = log["case:concept:name"].nunique()
+        num_events = len(log)
         
         # Discover process model
-        process_tree = pm4py.discover_process_tree_inductive(log)
-        bpmn_model = pm4py.convert_to_bpmn(process_tree)
+        from pm4py.objects.bpmn.exporter import exporter as bpmn_exporter
+        bpmn_model = pm4py.discover_bpmn_inductive(log)
+        bpmn_xml = bpmn_exporter.serialize(bpmn_model).decode('utf-8')
         
         return {
             "status": "success",
             "num_traces": num_traces,
             "num_events": num_events,
             "bpmn_model": bpmn_model,
+            "bpmn_xml": bpmn_xml,
             "message": "Event log analyzed successfully"
         }
         
@@ -286,4 +1286,4 @@ def analyze_event_log(file_path: str) -> Dict[str, Any]:
         return {
             "status": "error",
             "message": f"Error analyzing event log: {str(e)}"
-        }
\ No newline at end of file
+        }
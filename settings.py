@@ -0,0 +1,31 @@
+"""
+Environment configuration for the ProMoAI app.
+
+Streamlit re-executes app.py on every interaction, so environment lookups
+live in this imported module and run once per process.
+"""
+
+import hashlib
+import os
+
+# Authentication configuration
+AUTH_USERNAME = os.getenv('AUTH_USERNAME', 'admin')
+AUTH_PASSWORD = os.getenv('AUTH_PASSWORD', 'changeme')
+ENABLE_AUTH = os.getenv('ENABLE_AUTH', 'true').lower() == 'true'
+
+# SHA-256 digests of the credentials, so a login attempt only hashes the user input
+AUTH_USER_HASH = hashlib.sha256(AUTH_USERNAME.encode('utf-8')).digest()
+AUTH_PASS_HASH = hashlib.sha256(AUTH_PASSWORD.encode('utf-8')).digest()
+
+# Provider name -> environment variable holding its API key
+_KEY_ENV = (
+    ('OpenAI', 'OPENAI_API_KEY'),
+    ('Anthropic', 'ANTHROPIC_API_KEY'),
+    ('Google', 'GOOGLE_API_KEY'),
+    ('Cohere', 'COHERE_API_KEY'),
+)
+
+API_KEYS = {provider: key for provider, env in _KEY_ENV if (key := os.getenv(env))}
+
+# Retry failed AI requests with the other configured providers
+ENABLE_PROVIDER_FALLBACK = os.getenv('PROMOAI_PROVIDER_FALLBACK', 'false').lower() == 'true'